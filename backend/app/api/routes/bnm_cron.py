@@ -4,21 +4,40 @@ BNM Cron Routes
 Endpoints for BNM announcements scraping and processing.
 """
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request
 from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from playwright.async_api import Browser
 import asyncio
 
 from app.models.responses import CronResponse, StatusResponse
 from app.services.scraper import scrape_bnm_announcements
-from app.services.storage import check_document_exists, store_document_pages
-from app.services.ocr import extract_text_from_pdf
-from app.services.embeddings import generate_embeddings_batch
+from app.services.storage import (
+    check_document_exists,
+    load_known_keys,
+    remember_document_key,
+    save_known_keys,
+    store_document_pages
+)
+from app.services.ocr import extract_text_from_pdf_stream
+from app.services.embeddings import EmbedBatcher
 from app.utils.pdf_handler import download_pdf
-from app.config import BATCH_EMBEDDING_SIZE
+from app.config import (
+    PIPELINE_DOWNLOAD_WORKERS,
+    PIPELINE_OCR_WORKERS,
+    PIPELINE_EMBED_WORKERS,
+    PIPELINE_QUEUE_SIZE
+)
 
 
 router = APIRouter()
 
+# Marks the end of a stage's input queue
+_DONE = object()
+
 
 # Global state for cron job status
 cron_status = {
@@ -31,36 +50,51 @@ cron_status = {
 }
 
 
-async def process_new_document(date: str, title: str, doc_type: str, pdf_url: str) -> bool:
+async def _download_stage(browser: Browser, doc: Tuple[str, str, str, str]) -> Optional[Dict]:
     """
-    Process a new document through the full pipeline.
+    Download the PDF for a new document.
     
     Args:
-        date: Document date
-        title: Document title
-        doc_type: Document type
-        pdf_url: PDF URL
+        browser: Shared Playwright browser
+        doc: (date, title, doc_type, pdf_url) tuple
         
     Returns:
-        True if successful, False otherwise
+        Job dictionary for the OCR stage, or None if failed
     """
-    try:
-        # Download PDF
-        pdf_path = await download_pdf(pdf_url)
-        if not pdf_path:
-            return False
-        
-        # Extract text via OCR
-        ocr_data = extract_text_from_pdf(pdf_path)
-        if not ocr_data:
-            pdf_path.unlink()
-            return False
-        
-        # Prepare page data
-        pages = ocr_data.get('pages', [])
-        page_data_list = []
+    date, title, doc_type, pdf_url = doc
+    
+    pdf_path = await download_pdf(browser, pdf_url)
+    if not pdf_path:
+        return None
+    
+    return {
+        'date': date,
+        'title': title,
+        'doc_type': doc_type,
+        'pdf_url': pdf_url,
+        'pdf_path': pdf_path
+    }
+
+
+async def _ocr_stage(batcher: EmbedBatcher, job: Dict) -> Optional[Dict]:
+    """
+    Extract text via OCR, starting page embeddings as pages arrive.
+    
+    Args:
+        batcher: Shared embedding batcher
+        job: Job dictionary from the download stage
         
-        for page in pages:
+    Returns:
+        Job dictionary with ocr_data, page_data_list and embedding_tasks,
+        or None if failed
+    """
+    pdf_path: Path = job['pdf_path']
+    ocr_data = {}
+    page_data_list = []
+    embedding_tasks = []
+    
+    try:
+        async for page in extract_text_from_pdf_stream(pdf_path, ocr_data):
             page_number = page.get('index', 0) + 1
             markdown_content = page.get('markdown', '')
             
@@ -70,45 +104,153 @@ async def process_new_document(date: str, title: str, doc_type: str, pdf_url: st
             page_data_list.append({
                 'page_number': page_number,
                 'content': markdown_content,
-                'original_text': ocr_data.get('extractedText', ''),
                 'page_info': page
             })
+            embedding_tasks.append(asyncio.create_task(batcher.embed(markdown_content)))
         
         if not page_data_list:
             pdf_path.unlink()
-            return False
+            return None
+        
+        return {
+            **job,
+            'ocr_data': ocr_data,
+            'page_data_list': page_data_list,
+            'embedding_tasks': embedding_tasks
+        }
+        
+    except Exception:
+        for task in embedding_tasks:
+            task.cancel()
+        pdf_path.unlink(missing_ok=True)
+        raise
+
+
+async def _embed_store_stage(job: Dict) -> bool:
+    """
+    Wait for the document's page embeddings and store them.
+    
+    Args:
+        job: Job dictionary from the OCR stage
         
-        # Generate embeddings in batches
-        all_embeddings = []
-        
-        for i in range(0, len(page_data_list), BATCH_EMBEDDING_SIZE):
-            batch = page_data_list[i:i + BATCH_EMBEDDING_SIZE]
-            texts = [p['content'] for p in batch]
-            embeddings = generate_embeddings_batch(texts)
-            all_embeddings.extend(embeddings)
-        
-        # Store in Supabase
-        pages_stored = store_document_pages(
-            date=date,
-            title=title,
-            doc_type=doc_type,
-            pdf_url=pdf_url,
+    Returns:
+        True if any page was stored, False otherwise
+    """
+    try:
+        page_data_list = job['page_data_list']
+        
+        # Collect embeddings started during OCR
+        all_embeddings = await asyncio.gather(*job['embedding_tasks'])
+        
+        # Store in Supabase (the client is synchronous, so run it in a thread)
+        pages_stored = await asyncio.to_thread(
+            store_document_pages,
+            date=job['date'],
+            title=job['title'],
+            doc_type=job['doc_type'],
+            pdf_url=job['pdf_url'],
             pages_data=page_data_list,
             embeddings=all_embeddings,
-            ocr_data=ocr_data
+            ocr_data=job['ocr_data']
         )
         
+        if pages_stored == 0:
+            return False
+        
+        remember_document_key(job['title'], job['date'])
+        return True
+        
+    finally:
         # Clean up
-        pdf_path.unlink()
+        job['pdf_path'].unlink(missing_ok=True)
+
+
+async def _stage_worker(
+    handler: Callable[[object], Awaitable[object]],
+    in_q: asyncio.Queue,
+    out_q: Optional[asyncio.Queue],
+    outcomes: List[bool]
+):
+    """
+    Pull jobs until a sentinel arrives, passing successes downstream.
+    
+    Failed jobs are recorded in outcomes immediately. In the last stage
+    (no out_q), successful jobs are recorded as well.
+    """
+    while (job := await in_q.get()) is not _DONE:
+        try:
+            result = await handler(job)
+        except Exception as e:
+            print(f"[ERROR] Processing failed: {str(e)}")
+            result = None
         
-        return pages_stored > 0
+        if not result:
+            outcomes.append(False)
+        elif out_q is None:
+            outcomes.append(True)
+        else:
+            await out_q.put(result)
+
+
+async def _run_stage(
+    handler: Callable[[object], Awaitable[object]],
+    in_q: asyncio.Queue,
+    out_q: Optional[asyncio.Queue],
+    workers: int,
+    next_workers: int,
+    outcomes: List[bool]
+):
+    """Run a stage's workers, then signal every worker of the next stage."""
+    await asyncio.gather(*[_stage_worker(handler, in_q, out_q, outcomes) for _ in range(workers)])
+    
+    if out_q is not None:
+        for _ in range(next_workers):
+            await out_q.put(_DONE)
+
+
+async def _feed(q: asyncio.Queue, items: List, workers: int):
+    """Enqueue items followed by one sentinel per consuming worker."""
+    for item in items:
+        await q.put(item)
+    for _ in range(workers):
+        await q.put(_DONE)
+
+
+async def run_pipeline(browser: Browser, new_docs: List[Tuple[str, str, str, str]]) -> List[bool]:
+    """
+    Process documents through download -> OCR -> embed/store stages.
+    
+    Each stage has its own worker pool connected by bounded queues, so
+    stage k of one document overlaps with stage k+1 of the previous one.
+    Embedding requests from all documents share one EmbedBatcher.
+    
+    Args:
+        browser: Shared Playwright browser
+        new_docs: (date, title, doc_type, pdf_url) tuples
         
-    except Exception as e:
-        print(f"[ERROR] Processing failed: {str(e)}")
-        return False
+    Returns:
+        One success flag per document, in completion order
+    """
+    download_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    ocr_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    embed_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    outcomes: List[bool] = []
+    
+    async with EmbedBatcher() as batcher:
+        await asyncio.gather(
+            _feed(download_q, new_docs, PIPELINE_DOWNLOAD_WORKERS),
+            _run_stage(partial(_download_stage, browser), download_q, ocr_q,
+                       PIPELINE_DOWNLOAD_WORKERS, PIPELINE_OCR_WORKERS, outcomes),
+            _run_stage(partial(_ocr_stage, batcher), ocr_q, embed_q,
+                       PIPELINE_OCR_WORKERS, PIPELINE_EMBED_WORKERS, outcomes),
+            _run_stage(_embed_store_stage, embed_q, None,
+                       PIPELINE_EMBED_WORKERS, 0, outcomes)
+        )
+    
+    return outcomes
 
 
-async def run_daily_scrape():
+async def run_daily_scrape(browser: Browser):
     """Main cron job function."""
     global cron_status
     
@@ -120,51 +262,45 @@ async def run_daily_scrape():
     
     try:
         # Scrape BNM website
-        df = await scrape_bnm_announcements()
+        rows = await scrape_bnm_announcements(browser)
         
-        if df.empty:
+        if not rows:
             cron_status["status"] = "completed"
             cron_status["message"] = "No data scraped from BNM website"
             return
         
         # Check for new documents
+        await asyncio.to_thread(load_known_keys, list({row['title'] for row in rows}))
         new_docs = []
         
-        for idx, row in df.iterrows():
+        for row in rows:
             date = row['date']
             title = row['title']
             doc_type = row['type']
             links = row['links']
             
             # Check if already exists
-            if check_document_exists(title, date):
+            if await asyncio.to_thread(check_document_exists, title, date):
                 continue
             
             # New document found
             cron_status["new_documents"] += 1
             
-            # Get PDF links
-            pdf_links = [link for link in links if link.endswith('.pdf')]
+            # Get PDF links (matching the path, so query strings are allowed)
+            pdf_links = [link for link in links if urlparse(link).path.lower().endswith('.pdf')]
             
             for pdf_url in pdf_links:
                 new_docs.append((date, title, doc_type, pdf_url))
         
-        # Process new documents
-        for date, title, doc_type, pdf_url in new_docs:
-            try:
-                success = await process_new_document(date, title, doc_type, pdf_url)
-                if success:
-                    cron_status["processed"] += 1
-                else:
-                    cron_status["failed"] += 1
-                    
-                # Small delay
-                await asyncio.sleep(2)
-                
-            except Exception as e:
-                print(f"[ERROR] {str(e)}")
+        # Process new documents through the stage pipeline
+        for success in await run_pipeline(browser, new_docs):
+            if success:
+                cron_status["processed"] += 1
+            else:
                 cron_status["failed"] += 1
         
+        await asyncio.to_thread(save_known_keys)
+        
         # Update status
         cron_status["status"] = "completed"
         cron_status["message"] = f"Processed {cron_status['processed']} new documents, {cron_status['failed']} failed"
@@ -175,7 +311,7 @@ async def run_daily_scrape():
 
 
 @router.post("/cron/bnm-announcements", response_model=CronResponse)
-async def trigger_bnm_scrape(background_tasks: BackgroundTasks):
+async def trigger_bnm_scrape(request: Request, background_tasks: BackgroundTasks):
     """
     Trigger BNM announcements scraping and processing.
     
@@ -188,7 +324,7 @@ async def trigger_bnm_scrape(background_tasks: BackgroundTasks):
         raise HTTPException(status_code=409, detail="Cron job already running")
     
     # Start background task
-    background_tasks.add_task(run_daily_scrape)
+    background_tasks.add_task(run_daily_scrape, request.app.state.browser)
     
     return CronResponse(
         status="started",
@@ -19,21 +19,39 @@ load_dotenv(dotenv_path=ENV_PATH)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_ACCESS_TOKEN")
+SUPABASE_TIMEOUT = int(os.getenv("SUPABASE_TIMEOUT", "60"))  # seconds per PostgREST request
 
 # External Services
 OCR_WEBHOOK_URL = os.getenv("OCR_WEBHOOK_URL", "https://n8n.ammariskandar-n8n.uk/webhook/b2f1db0b-ee85-4ca2-bfcd-313455373059")
+OCR_MIN_INTERVAL = float(os.getenv("OCR_MIN_INTERVAL", "0.5"))  # seconds between OCR requests
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "3"))
 
 # BNM Settings
 BNM_URL = os.getenv("BNM_URL", "https://www.bnm.gov.my/banking-islamic-banking")
 TABLE_NAME = "bnm_announcements"
+INSERT_CHUNK_SIZE = 500  # rows per insert, keeps PostgREST payloads bounded
+SELECT_PAGE_SIZE = 1000  # PostgREST's default max rows per response
+EXISTS_CHUNK_SIZE = 50  # titles per in_() filter, keeps the query URL short
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 
 # OpenAI Settings
 EMBEDDING_MODEL = "text-embedding-3-large"
 EMBEDDING_DIMENSIONS = 1536
-BATCH_EMBEDDING_SIZE = 10
+BATCH_EMBEDDING_SIZE = int(os.getenv("BATCH_EMBEDDING_SIZE", "256"))  # max inputs per request
+EMBEDDING_MAX_INPUT_TOKENS = 8191  # per-input limit of the embedding model
+EMBEDDING_MAX_BATCH_TOKENS = 250_000  # stays under the 300k tokens/request API cap
+EMBEDDING_BATCH_WINDOW = 0.05  # seconds to wait for more texts before flushing a batch
+
+# Pipeline Settings (workers per stage: download -> OCR -> embed/store)
+PIPELINE_DOWNLOAD_WORKERS = int(os.getenv("PIPELINE_DOWNLOAD_WORKERS", "4"))
+PIPELINE_OCR_WORKERS = int(os.getenv("PIPELINE_OCR_WORKERS", "3"))
+PIPELINE_EMBED_WORKERS = int(os.getenv("PIPELINE_EMBED_WORKERS", "4"))
+PIPELINE_QUEUE_SIZE = 8
 
 # File Storage
 DOWNLOAD_DIR = Path("temp_bnm_downloads")
+KEY_CACHE_PATH = Path(".cache") / "bnm_keys.pkl"  # known (title, date) keys, kept between runs
+KEY_CACHE_TTL = int(os.getenv("KEY_CACHE_TTL", str(7 * 24 * 3600)))  # seconds before a reload from Supabase, a week of daily runs
 
 # Application Settings
 APP_NAME = "BNM Announcements Cron Service"
@@ -4,18 +4,43 @@ FastAPI Main Application
 Entry point for the BNM announcements cron service.
 """
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from playwright.async_api import async_playwright
 
 from app.config import APP_NAME, APP_VERSION
 from app.api.routes import health, bnm_cron
+from app.services.embeddings import openai_client
+from app.services.ocr import ocr_client
+from app.utils.pdf_handler import download_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Launch one shared Chromium and close shared HTTP clients on shutdown."""
+    try:
+        async with async_playwright() as p:
+            app.state.browser = await p.chromium.launch(
+                headless=True,
+                args=["--no-sandbox", "--disable-dev-shm-usage"]
+            )
+            try:
+                yield
+            finally:
+                await app.state.browser.close()
+    finally:
+        await ocr_client.aclose()
+        await download_client.aclose()
+        await openai_client.close()
 
 
 # Initialize FastAPI app
 app = FastAPI(
     title=APP_NAME,
     description="Daily scraping and processing of BNM announcements",
-    version=APP_VERSION
+    version=APP_VERSION,
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -4,20 +4,123 @@ Embeddings Service
 Handles OpenAI embeddings generation.
 """
 
-from typing import List
-from openai import OpenAI
+import asyncio
+from contextlib import suppress
+from functools import lru_cache
+from typing import List, Set, Tuple
+import httpx
+import tiktoken
+from openai import AsyncOpenAI
 
-from app.config import OPENAI_API_KEY, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+from app.config import (
+    OPENAI_API_KEY,
+    EMBEDDING_MODEL,
+    EMBEDDING_DIMENSIONS,
+    BATCH_EMBEDDING_SIZE,
+    EMBEDDING_MAX_INPUT_TOKENS,
+    EMBEDDING_MAX_BATCH_TOKENS,
+    EMBEDDING_BATCH_WINDOW
+)
+from app.utils.retry import retry_transient
 
 
+# Maps whitespace control characters to spaces in one pass
+_WHITESPACE_TABLE = str.maketrans({"\n": " ", "\r": " ", "\t": " "})
+
 # Initialize OpenAI client
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+openai_client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    max_retries=0,  # retry_transient is the only retry layer
+    http_client=httpx.AsyncClient(http2=True, limits=httpx.Limits(max_connections=64))
+)
+
+
+@retry_transient
+async def _create_embeddings(inputs: List[str]) -> List[List[float]]:
+    """Call the embeddings endpoint, retrying rate limits and server errors."""
+    response = await openai_client.embeddings.create(
+        input=inputs,
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS
+    )
+    
+    return [item.embedding for item in response.data]
+
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> tiktoken.Encoding:
+    """Load the tokenizer for the embedding model once."""
+    return tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+
+def _clean_texts(texts: List[str]) -> Tuple[List[str], List[int]]:
+    """
+    Normalize whitespace and truncate texts to the model's input limit.
+    
+    Truncation counts tokens rather than characters, so inputs use the
+    full EMBEDDING_MAX_INPUT_TOKENS budget.
+    
+    Args:
+        texts: Raw text strings
+        
+    Returns:
+        Tuple of (cleaned texts, token count per text)
+    """
+    encoding = _get_encoding()
+    cleaned_texts = [text.translate(_WHITESPACE_TABLE).strip() for text in texts]
+    token_counts = []
+    
+    # OCR text can contain strings like <|endoftext|>; encode them as plain text
+    for i, tokens in enumerate(encoding.encode_batch(cleaned_texts, disallowed_special=())):
+        if len(tokens) > EMBEDDING_MAX_INPUT_TOKENS:
+            tokens = tokens[:EMBEDDING_MAX_INPUT_TOKENS]
+            cleaned_texts[i] = encoding.decode(tokens)
+        token_counts.append(len(tokens))
+    
+    return cleaned_texts, token_counts
+
+
+def _pack_batches(texts: List[str], token_counts: List[int]) -> List[List[str]]:
+    """
+    Greedily pack texts into request-sized batches.
+    
+    Each batch holds at most BATCH_EMBEDDING_SIZE inputs and
+    EMBEDDING_MAX_BATCH_TOKENS tokens.
+    
+    Args:
+        texts: Cleaned text strings
+        token_counts: Token count per text
+        
+    Returns:
+        List of batches, in input order
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    
+    for text, tokens in zip(texts, token_counts):
+        if batch and (len(batch) >= BATCH_EMBEDDING_SIZE or batch_tokens + tokens > EMBEDDING_MAX_BATCH_TOKENS):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        
+        batch.append(text)
+        batch_tokens += tokens
+    
+    if batch:
+        batches.append(batch)
+    
+    return batches
 
 
-def generate_embeddings_batch(texts: List[str]) -> List[List[float]]:
+async def generate_embeddings_batch(texts: List[str]) -> List[List[float]]:
     """
     Generate embeddings for multiple texts in batch.
     
+    Texts are packed into as few requests as the API limits allow,
+    so most documents need a single round-trip. Multiple requests are
+    issued concurrently.
+    
     Args:
         texts: List of text strings to embed
         
@@ -25,24 +128,16 @@ def generate_embeddings_batch(texts: List[str]) -> List[List[float]]:
         List of embedding vectors
     """
     # Clean texts
-    cleaned_texts = []
-    for text in texts:
-        cleaned = text.replace("\n", " ").strip()
-        if len(cleaned) > 8000:
-            cleaned = cleaned[:8000]
-        cleaned_texts.append(cleaned)
+    cleaned_texts, token_counts = _clean_texts(texts)
     
     # Generate embeddings
-    response = openai_client.embeddings.create(
-        input=cleaned_texts,
-        model=EMBEDDING_MODEL,
-        dimensions=EMBEDDING_DIMENSIONS
-    )
+    batches = _pack_batches(cleaned_texts, token_counts)
+    results = await asyncio.gather(*[_create_embeddings(batch) for batch in batches])
     
-    return [item.embedding for item in response.data]
+    return [embedding for batch in results for embedding in batch]
 
 
-def generate_embedding_single(text: str) -> List[float]:
+async def generate_embedding_single(text: str) -> List[float]:
     """
     Generate embedding for a single text.
     
@@ -52,14 +147,86 @@ def generate_embedding_single(text: str) -> List[float]:
     Returns:
         Embedding vector
     """
-    text = text.replace("\n", " ").strip()
-    if len(text) > 8000:
-        text = text[:8000]
+    cleaned_texts, _ = _clean_texts([text])
     
-    response = openai_client.embeddings.create(
-        input=[text],
-        model=EMBEDDING_MODEL,
-        dimensions=EMBEDDING_DIMENSIONS
-    )
+    return (await _create_embeddings(cleaned_texts))[0]
+
+
+class EmbedBatcher:
+    """
+    Coalesce embedding requests from concurrent callers into shared API calls.
+    
+    Texts are queued and flushed when BATCH_EMBEDDING_SIZE texts are waiting
+    or EMBEDDING_BATCH_WINDOW seconds have passed since the first one,
+    whichever comes first. Use as an async context manager:
+    
+        async with EmbedBatcher() as batcher:
+            embedding = await batcher.embed(text)
+    """
+    
+    def __init__(self, max_batch: int = BATCH_EMBEDDING_SIZE, window: float = EMBEDDING_BATCH_WINDOW):
+        self.max_batch = max_batch
+        self.window = window
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._collector = None
+        self._flushes: Set[asyncio.Task] = set()
     
-    return response.data[0].embedding
+    async def __aenter__(self) -> "EmbedBatcher":
+        self._collector = asyncio.create_task(self._collect())
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        self._collector.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._collector
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+    
+    async def embed(self, text: str) -> List[float]:
+        """
+        Embed a single text as part of the next shared batch.
+        
+        Args:
+            text: Text string to embed
+            
+        Returns:
+            Embedding vector
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+    
+    async def _collect(self):
+        """Gather queued texts into batches and flush each in the background."""
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+    
+    async def _flush(self, batch: List[Tuple[str, asyncio.Future]]):
+        """Embed one batch and resolve its callers' futures."""
+        try:
+            embeddings = await generate_embeddings_batch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
@@ -4,14 +4,112 @@ OCR Service
 Handles PDF text extraction via n8n webhook.
 """
 
-import requests
+import asyncio
+import json
+import httpx
+from aiolimiter import AsyncLimiter
 from pathlib import Path
-from typing import Optional, Dict
+from typing import AsyncIterator, BinaryIO, Optional, Dict
 
-from app.config import OCR_WEBHOOK_URL
+from app.config import OCR_WEBHOOK_URL, OCR_CONCURRENCY, OCR_MIN_INTERVAL
+from app.utils.retry import retry_transient
 
 
-def extract_text_from_pdf(pdf_path: Path) -> Optional[Dict]:
+# Shared keep-alive HTTP/2 client for the OCR webhook
+ocr_client = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(180.0),
+    limits=httpx.Limits(max_keepalive_connections=16, max_connections=32)
+)
+
+# Caps in-flight OCR requests to respect the webhook's capacity
+ocr_semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+
+# Enforces a minimum interval between OCR webhook requests
+ocr_limiter = AsyncLimiter(1, OCR_MIN_INTERVAL)
+
+# Content types for which the webhook streams one JSON object per line
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+
+
+@retry_transient
+async def _open_ocr_stream(pdf_path: Path, pdf_file: BinaryIO) -> httpx.Response:
+    """
+    Post the PDF to the OCR webhook and return the unread response.
+    
+    httpx streams the open file into the multipart body in 64KB chunks
+    (rewinding it on each retry), so the PDF is never held in memory.
+    """
+    async with ocr_limiter:
+        files = {'data': (pdf_path.name, pdf_file, 'application/pdf')}
+        request = ocr_client.build_request("POST", OCR_WEBHOOK_URL, files=files)
+        response = await ocr_client.send(request, stream=True)
+    
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError:
+        await response.aclose()
+        raise
+    
+    return response
+
+
+def _split_document(data: Dict, document: Dict) -> list:
+    """Copy document-level fields into document and return the pages."""
+    document.update({key: value for key, value in data.items() if key != 'pages'})
+    return data.get('pages', [])
+
+
+async def extract_text_from_pdf_stream(pdf_path: Path, document: Dict) -> AsyncIterator[Dict]:
+    """
+    Extract text from PDF using n8n OCR webhook, yielding pages as they arrive.
+    
+    NDJSON responses are consumed line by line, so pages can be processed
+    before OCR of the whole document finishes. A single JSON response is
+    parsed once and its pages are yielded in order.
+    
+    Args:
+        pdf_path: Path to PDF file
+        document: Dictionary that receives document-level OCR fields
+            (e.g. model, extractedText); complete once iteration ends
+        
+    Yields:
+        OCR page dictionaries
+        
+    Raises:
+        httpx.HTTPError: If the webhook request fails after retries
+    """
+    with open(pdf_path, 'rb') as pdf_file:
+        async with ocr_semaphore:
+            response = await _open_ocr_stream(pdf_path, pdf_file)
+            
+            try:
+                if response.headers.get("content-type", "").startswith(NDJSON_CONTENT_TYPES):
+                    async for line in response.aiter_lines():
+                        if not line.strip():
+                            continue
+                        
+                        item = json.loads(line)
+                        if 'markdown' in item:
+                            yield item
+                        else:
+                            for page in _split_document(item, document):
+                                yield page
+                else:
+                    ocr_data = json.loads(await response.aread())
+                    
+                    # Handle list response
+                    if isinstance(ocr_data, list) and len(ocr_data) > 0:
+                        ocr_data = ocr_data[0]
+                    
+                    for page in _split_document(ocr_data, document):
+                        yield page
+                        
+            finally:
+                await response.aclose()
+
+
+async def extract_text_from_pdf(pdf_path: Path) -> Optional[Dict]:
     """
     Extract text from PDF using n8n OCR webhook.
     
@@ -22,22 +120,10 @@ def extract_text_from_pdf(pdf_path: Path) -> Optional[Dict]:
         OCR data dictionary or None if failed
     """
     try:
-        with open(pdf_path, 'rb') as f:
-            files = {'data': (pdf_path.name, f, 'application/pdf')}
-            response = requests.post(
-                OCR_WEBHOOK_URL,
-                files=files,
-                timeout=180
-            )
-        
-        response.raise_for_status()
-        ocr_data = response.json()
-        
-        # Handle list response
-        if isinstance(ocr_data, list) and len(ocr_data) > 0:
-            ocr_data = ocr_data[0]
+        document = {}
+        pages = [page async for page in extract_text_from_pdf_stream(pdf_path, document)]
         
-        return ocr_data
+        return {**document, 'pages': pages}
         
     except Exception as e:
         print(f"[ERROR] OCR extraction failed: {str(e)}")
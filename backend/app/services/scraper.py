@@ -4,31 +4,33 @@ BNM Website Scraper Service
 Handles scraping of BNM announcements from the website.
 """
 
-import pandas as pd
-from playwright.async_api import async_playwright
-from bs4 import BeautifulSoup
-from typing import Optional
+from lxml import html as lxml_html
+from playwright.async_api import Browser
+from typing import Dict, List
 
-from app.config import BNM_URL
+from app.config import BNM_URL, USER_AGENT
 
 
-async def scrape_bnm_announcements() -> pd.DataFrame:
+def _cell_text(td, separator: str = "") -> str:
+    """Join a cell's stripped text nodes, skipping empty ones."""
+    return separator.join(text.strip() for text in td.xpath(".//text()") if text.strip())
+
+
+async def scrape_bnm_announcements(browser: Browser) -> List[Dict]:
     """
     Scrape BNM website for announcements.
     
+    Args:
+        browser: Shared Playwright browser
+        
     Returns:
-        DataFrame with columns: date, title, type, links
+        List of row dictionaries with keys: date, title, type, links
     """
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=["--no-sandbox", "--disable-dev-shm-usage"]
-            )
-            
-            page = await browser.new_page(
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            )
+        context = await browser.new_context(user_agent=USER_AGENT)
+        
+        try:
+            page = await context.new_page()
             
             await page.goto(BNM_URL, wait_until="networkidle", timeout=60000)
             await page.wait_for_selector("table#filta", timeout=60000)
@@ -44,28 +46,28 @@ async def scrape_bnm_announcements() -> pd.DataFrame:
             await page.wait_for_timeout(3000)
             
             html = await page.content()
-            await browser.close()
+        finally:
+            await context.close()
         
         # Parse HTML
-        soup = BeautifulSoup(html, "html.parser")
-        table = soup.find("table", id="filta")
+        tree = lxml_html.fromstring(html)
         
         rows = []
-        for tr in table.select("tbody tr"):
-            tds = tr.find_all("td")
+        for tr in tree.xpath('//table[@id="filta"]//tbody//tr'):
+            tds = tr.xpath(".//td")
             rows.append({
-                "date": tds[0].get_text(strip=True),
-                "title": tds[1].get_text(" ", strip=True),
-                "type": tds[2].get_text(strip=True),
+                "date": _cell_text(tds[0]),
+                "title": _cell_text(tds[1], " "),
+                "type": _cell_text(tds[2]),
                 "links": [
-                    a["href"] if a["href"].startswith("http")
-                    else "https://www.bnm.gov.my" + a["href"]
-                    for a in tds[1].find_all("a", href=True)
+                    href if href.startswith("http")
+                    else "https://www.bnm.gov.my" + href
+                    for href in tds[1].xpath(".//a/@href")
                 ]
             })
         
-        return pd.DataFrame(rows)
+        return rows
         
     except Exception as e:
         print(f"[ERROR] Scraping failed: {str(e)}")
-        return pd.DataFrame()
+        return []
@@ -4,21 +4,48 @@ Storage Service
 Handles Supabase database operations.
 """
 
-from typing import Dict, List
-from datetime import datetime
+import pickle
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime, timezone
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
 
-from app.config import SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, TABLE_NAME
+from app.config import (
+    SUPABASE_URL,
+    SUPABASE_SERVICE_ROLE_KEY,
+    SUPABASE_TIMEOUT,
+    BNM_URL,
+    TABLE_NAME,
+    INSERT_CHUNK_SIZE,
+    SELECT_PAGE_SIZE,
+    EXISTS_CHUNK_SIZE,
+    KEY_CACHE_PATH,
+    KEY_CACHE_TTL
+)
 
 
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# Initialize Supabase client (its PostgREST session is reused across calls)
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_SERVICE_ROLE_KEY,
+    options=ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT)
+)
+
+# Local set of known (title, date) keys, loaded by load_known_keys()
+_known_keys: Optional[Set[Tuple[str, str]]] = None
+# When _known_keys was last reloaded from Supabase (epoch seconds)
+_known_keys_fetched_at: float = 0.0
 
 
 def check_document_exists(title: str, date: str) -> bool:
     """
     Check if document already exists in database.
     
+    Once the local key set is loaded, hits are answered without a Supabase
+    round-trip. Misses are confirmed remotely, so documents stored by
+    another writer since the last reload are not processed again.
+    
     Args:
         title: Document title
         date: Document date
@@ -26,11 +53,186 @@ def check_document_exists(title: str, date: str) -> bool:
     Returns:
         True if exists, False otherwise
     """
+    if _known_keys is not None and (title, date) in _known_keys:
+        return True
+    
     try:
         result = supabase.table(TABLE_NAME).select("id").eq("title", title).eq("date", date).limit(1).execute()
-        return len(result.data) > 0
     except:
         return False
+    
+    exists = len(result.data) > 0
+    if exists:
+        remember_document_key(title, date)
+    return exists
+
+
+def get_existing_document_keys(titles: List[str]) -> Set[Tuple[str, str]]:
+    """
+    Fetch the (title, date) keys already stored for the given titles.
+    
+    Titles are queried EXISTS_CHUNK_SIZE at a time, and each chunk is paged
+    through SELECT_PAGE_SIZE rows at a time, since the table holds one row
+    per document page. Errors are raised rather than swallowed, since an
+    empty result would cause every scraped document to be reprocessed.
+    
+    Args:
+        titles: Scraped document titles
+        
+    Returns:
+        Set of (title, date) tuples
+    """
+    keys = set()
+    
+    for i in range(0, len(titles), EXISTS_CHUNK_SIZE):
+        chunk = titles[i:i + EXISTS_CHUNK_SIZE]
+        start = 0
+        
+        while True:
+            result = (
+                supabase.table(TABLE_NAME)
+                .select("title,date")
+                .order("id")
+                .in_("title", chunk)
+                .range(start, start + SELECT_PAGE_SIZE - 1)
+                .execute()
+            )
+            keys.update((row['title'], row['date']) for row in result.data)
+            
+            if len(result.data) < SELECT_PAGE_SIZE:
+                break
+            start += SELECT_PAGE_SIZE
+    
+    return keys
+
+
+def load_known_keys(titles: List[str]) -> Set[Tuple[str, str]]:
+    """
+    Load the known document keys, preferring the local cache file.
+    
+    The set (in memory or at KEY_CACHE_PATH) is reused for KEY_CACHE_TTL
+    seconds after its last fetch, then reloaded from Supabase for the
+    scraped titles so rows deleted there are picked up again. Keys missing
+    from the set are confirmed by check_document_exists, so the TTL only
+    needs to catch deletions.
+    
+    Args:
+        titles: Scraped document titles
+        
+    Returns:
+        Set of (title, date) tuples
+    """
+    global _known_keys, _known_keys_fetched_at
+    
+    if _known_keys is None and KEY_CACHE_PATH.exists():
+        with open(KEY_CACHE_PATH, 'rb') as f:
+            cache = pickle.load(f)
+        if isinstance(cache, dict):
+            _known_keys = cache["keys"]
+            _known_keys_fetched_at = cache["fetched_at"]
+    
+    if _known_keys is None or time.time() - _known_keys_fetched_at > KEY_CACHE_TTL:
+        _known_keys = get_existing_document_keys(titles)
+        _known_keys_fetched_at = time.time()
+    
+    return _known_keys
+
+
+def remember_document_key(title: str, date: str):
+    """Record a newly stored document in the local key set."""
+    if _known_keys is not None:
+        _known_keys.add((title, date))
+
+
+def save_known_keys():
+    """Write the local key set to KEY_CACHE_PATH for the next run."""
+    if _known_keys is None:
+        return
+    
+    KEY_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = KEY_CACHE_PATH.with_suffix(".tmp")
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({"keys": _known_keys, "fetched_at": _known_keys_fetched_at}, f)
+    tmp_path.replace(KEY_CACHE_PATH)
+
+
+def _build_page_row(
+    date: str,
+    title: str,
+    doc_type: str,
+    pdf_url: str,
+    page_data: Dict,
+    embedding: List[float],
+    total_pages: int,
+    original_text: Optional[str],
+    ocr_data: Dict,
+    processed_at: str
+) -> Dict:
+    """Build the table row for a single page."""
+    source_metadata = {
+        "scraped_date": date,
+        "scraped_title": title,
+        "scraped_type": doc_type,
+        "source": "BNM Website - FastAPI Cron",
+        "source_url": BNM_URL,
+        "scraped_at": processed_at
+    }
+    
+    metadata = {
+        "date": date,
+        "title": title,
+        "type": doc_type,
+        "page_number": page_data['page_number'],
+        "total_pages": total_pages,
+        "model": ocr_data.get('model', 'mistral-ocr'),
+        "header": page_data['page_info'].get('header', ''),
+        "footer": page_data['page_info'].get('footer', ''),
+        "dimensions": page_data['page_info'].get('dimensions', {}),
+        "tables_count": len(page_data['page_info'].get('tables', [])),
+        "images_count": len(page_data['page_info'].get('images', [])),
+        "hyperlinks_count": len(page_data['page_info'].get('hyperlinks', [])),
+        "processed_at": processed_at
+    }
+    
+    return {
+        "date": date,
+        "title": title,
+        "type": doc_type,
+        "pdf_url": pdf_url,
+        "page_number": page_data['page_number'],
+        "content": page_data['content'],
+        "original_text": original_text,
+        "source_metadata": source_metadata,
+        "metadata": metadata,
+        "embedding": embedding
+    }
+
+
+def _insert_rows(rows: List[Dict]) -> int:
+    """
+    Insert rows in one request, falling back to per-row inserts on failure.
+    
+    Args:
+        rows: Table rows to insert
+        
+    Returns:
+        Number of rows successfully inserted
+    """
+    try:
+        supabase.table(TABLE_NAME).insert(rows).execute()
+        return len(rows)
+    except Exception as e:
+        print(f"[ERROR] Batch insert failed, retrying per row: {str(e)}")
+    
+    inserted = 0
+    for row in rows:
+        try:
+            supabase.table(TABLE_NAME).insert(row).execute()
+            inserted += 1
+        except Exception as e:
+            print(f"[ERROR] Failed to store page {row['page_number']}: {str(e)}")
+    
+    return inserted
 
 
 def store_document_pages(
@@ -45,6 +247,10 @@ def store_document_pages(
     """
     Store document pages in Supabase.
     
+    Pages are inserted in batches of INSERT_CHUNK_SIZE rows. The full
+    document text is stored once, on the first page row only; later rows
+    get NULL, the same as the standalone cron service writes.
+    
     Args:
         date: Document date
         title: Document title
@@ -57,52 +263,20 @@ def store_document_pages(
     Returns:
         Number of pages successfully stored
     """
-    pages_stored = 0
+    original_text = ocr_data.get('extractedText', '')
+    now_iso = datetime.now(timezone.utc).isoformat()
+    total_pages = len(pages_data)
     
-    for page_data, embedding in zip(pages_data, embeddings):
-        try:
-            source_metadata = {
-                "scraped_date": date,
-                "scraped_title": title,
-                "scraped_type": doc_type,
-                "source": "BNM Website - FastAPI Cron",
-                "source_url": "https://www.bnm.gov.my/banking-islamic-banking",
-                "scraped_at": datetime.utcnow().isoformat()
-            }
-            
-            metadata = {
-                "date": date,
-                "title": title,
-                "type": doc_type,
-                "page_number": page_data['page_number'],
-                "total_pages": len(pages_data),
-                "model": ocr_data.get('model', 'mistral-ocr'),
-                "header": page_data['page_info'].get('header', ''),
-                "footer": page_data['page_info'].get('footer', ''),
-                "dimensions": page_data['page_info'].get('dimensions', {}),
-                "tables_count": len(page_data['page_info'].get('tables', [])),
-                "images_count": len(page_data['page_info'].get('images', [])),
-                "hyperlinks_count": len(page_data['page_info'].get('hyperlinks', [])),
-                "processed_at": datetime.utcnow().isoformat()
-            }
-            
-            data = {
-                "date": date,
-                "title": title,
-                "type": doc_type,
-                "pdf_url": pdf_url,
-                "page_number": page_data['page_number'],
-                "content": page_data['content'],
-                "original_text": page_data['original_text'],
-                "source_metadata": source_metadata,
-                "metadata": metadata,
-                "embedding": embedding
-            }
-            
-            supabase.table(TABLE_NAME).insert(data).execute()
-            pages_stored += 1
-            
-        except Exception as e:
-            print(f"[ERROR] Failed to store page {page_data['page_number']}: {str(e)}")
+    rows = [
+        _build_page_row(
+            date, title, doc_type, pdf_url, page_data, embedding, total_pages,
+            original_text if i == 0 else None, ocr_data, now_iso
+        )
+        for i, (page_data, embedding) in enumerate(zip(pages_data, embeddings))
+    ]
+    
+    pages_stored = 0
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        pages_stored += _insert_rows(rows[i:i + INSERT_CHUNK_SIZE])
     
     return pages_stored
@@ -1,67 +1,128 @@
 """
 PDF Handler Utility
 
-Handles PDF downloading using Playwright.
+Handles PDF downloading over plain HTTP, with Playwright as a fallback.
 """
 
+import os
+import tempfile
+import aiofiles
+import httpx
 from pathlib import Path
 from typing import Optional
-from playwright.async_api import async_playwright
+from urllib.parse import urlparse
+from playwright.async_api import Browser
 
-from app.config import DOWNLOAD_DIR
+from app.config import DOWNLOAD_DIR, USER_AGENT
 
 
-async def download_pdf(url: str) -> Optional[Path]:
+# Shared HTTP client for PDF downloads
+download_client = httpx.AsyncClient(
+    follow_redirects=True,
+    timeout=httpx.Timeout(60.0),
+    headers={"User-Agent": USER_AGENT}
+)
+
+
+def _reserve_pdf_path(url: str) -> Path:
+    """
+    Create a unique local file for a download.
+    
+    Concurrent jobs can fetch PDFs that share a basename (or the same URL),
+    so the URL's basename is only used as a readable prefix.
+    """
+    stem = Path(urlparse(url).path).stem or "download"
+    fd, path = tempfile.mkstemp(dir=DOWNLOAD_DIR, prefix=f"{stem}_", suffix=".pdf")
+    os.close(fd)
+    return Path(path)
+
+
+async def _is_pdf(filepath: Path) -> bool:
+    """Check for the PDF header, which may follow up to 1KB of leading junk."""
+    async with aiofiles.open(filepath, 'rb') as f:
+        return b"%PDF-" in await f.read(1024)
+
+
+async def _download_with_browser(browser: Browser, url: str, filepath: Path) -> bool:
+    """
+    Download PDF through Playwright for URLs that reject plain HTTP clients.
+    
+    Args:
+        browser: Shared Playwright browser
+        url: PDF URL to download
+        filepath: Destination path
+        
+    Returns:
+        True if the file was saved, False otherwise
+    """
+    context = await browser.new_context(accept_downloads=True, user_agent=USER_AGENT)
+    page = await context.new_page()
+    
+    try:
+        async with page.expect_download(timeout=30000) as download_info:
+            await page.goto(url, wait_until="networkidle", timeout=30000)
+        
+        download = await download_info.value
+        await download.save_as(filepath)
+        return True
+        
+    except Exception as e:
+        print(f"[ERROR] Browser download failed: {str(e)}")
+        return False
+        
+    finally:
+        await context.close()
+
+
+async def download_pdf(browser: Browser, url: str) -> Optional[Path]:
     """
-    Download PDF using Playwright.
+    Download PDF by streaming it to disk.
+    
+    Falls back to Playwright when the server answers 403 or returns
+    something other than a PDF.
     
     Args:
+        browser: Shared Playwright browser
         url: PDF URL to download
         
     Returns:
         Path to downloaded PDF or None if failed
     """
+    filepath = None
+    
     try:
         # Ensure download directory exists
         DOWNLOAD_DIR.mkdir(exist_ok=True)
         
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=['--no-sandbox', '--disable-dev-shm-usage']
-            )
-            
-            context = await browser.new_context(accept_downloads=True)
-            page = await context.new_page()
-            
-            try:
-                async with page.expect_download(timeout=30000) as download_info:
-                    await page.goto(url, wait_until="networkidle", timeout=30000)
-                
-                download = await download_info.value
-                
-                # Generate filename
-                filename = url.split('/')[-1]
-                if not filename.endswith('.pdf'):
-                    filename += '.pdf'
-                
-                filepath = DOWNLOAD_DIR / filename
-                await download.save_as(filepath)
-                
-                # Validate file size
-                if filepath.stat().st_size < 1000:
-                    filepath.unlink()
-                    await browser.close()
-                    return None
-                
-                await browser.close()
-                return filepath
-                
-            except Exception as e:
-                print(f"[ERROR] Download failed: {str(e)}")
-                await browser.close()
-                return None
+        filepath = _reserve_pdf_path(url)
+        
+        async with download_client.stream("GET", url) as response:
+            saved = response.status_code != 403
+            if saved:
+                response.raise_for_status()
                 
+                async with aiofiles.open(filepath, 'wb') as f:
+                    async for chunk in response.aiter_bytes(65536):
+                        await f.write(chunk)
+        
+        # A 200 can still be an HTML challenge or error page
+        if saved and not await _is_pdf(filepath):
+            print(f"[ERROR] {url} did not return a PDF, retrying with the browser")
+            saved = False
+        
+        if not saved and not await _download_with_browser(browser, url, filepath):
+            filepath.unlink(missing_ok=True)
+            return None
+        
+        # Validate file size and type
+        if filepath.stat().st_size < 1000 or not await _is_pdf(filepath):
+            filepath.unlink()
+            return None
+        
+        return filepath
+        
     except Exception as e:
-        print(f"[ERROR] PDF handler error: {str(e)}")
+        print(f"[ERROR] Download failed: {str(e)}")
+        if filepath:
+            filepath.unlink(missing_ok=True)
         return None
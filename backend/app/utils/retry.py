@@ -0,0 +1,43 @@
+"""
+Retry Utility
+
+Shared retry policy for calls to external services.
+"""
+
+import httpx
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+
+
+# HTTP status codes worth retrying (rate limits and transient server errors)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """
+    Classify an exception as transient (retry) or permanent (fail fast).
+    
+    Args:
+        exc: Exception raised by the external call
+        
+    Returns:
+        True if the call should be retried, False otherwise
+    """
+    if isinstance(exc, (RateLimitError, APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in RETRYABLE_STATUS_CODES
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS_CODES
+    if isinstance(exc, httpx.TransportError):
+        return True
+    return False
+
+
+# Up to 3 attempts with exponential backoff between them
+retry_transient = retry(
+    retry=retry_if_exception(is_retryable_error),
+    wait=wait_exponential(min=1, max=30),
+    stop=stop_after_attempt(3),
+    reraise=True
+)
@@ -19,30 +19,55 @@ Usage:
     uvicorn backend_bnm_cron:app --host 0.0.0.0 --port 8000 --workers 4
 """
 
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from dataclasses import dataclass, asdict, replace
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import asyncio
+import hashlib
+import json
 import os
-import requests
+import pickle
+import tempfile
+import uuid
+import httpx
+import orjson
 from pathlib import Path
-from datetime import datetime
-from playwright.async_api import async_playwright
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from playwright.async_api import async_playwright, Browser
+from selectolax.parser import HTMLParser, Node
 import pandas as pd
-from openai import OpenAI
+import tiktoken
+from openai import OpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+from aiolimiter import AsyncLimiter
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Close the shared OCR and Redis clients on shutdown."""
+    yield
+    ocr_client.close()
+    if redis_client:
+        await redis_client.aclose()
+
+
 # Initialize FastAPI
 app = FastAPI(
     title="BNM Announcements Cron Service",
     description="Daily scraping and processing of BNM announcements",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -61,23 +86,74 @@ SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_ACC
 OCR_WEBHOOK_URL = "https://n8n.ammariskandar-n8n.uk/webhook/b2f1db0b-ee85-4ca2-bfcd-313455373059"
 EMBEDDING_MODEL = "text-embedding-3-large"
 EMBEDDING_DIMENSIONS = 1536
+EMBEDDING_DECIMALS = 6  # halves the JSON size of a vector, cosine similarity unchanged to ~1e-10
 BNM_URL = "https://www.bnm.gov.my/banking-islamic-banking"
+BNM_DATATABLE_URL = os.getenv("BNM_DATATABLE_URL")  # JSON source behind table#filta, if known
+BNM_TABLE_LENGTH = 149
 TABLE_NAME = "bnm_announcements"
+PAGE_CONFLICT_KEY = "title,date,pdf_url,page_number"  # unique key on TABLE_NAME
+EMBEDDING_CACHE_TABLE = "embedding_cache"
 DOWNLOAD_DIR = Path("temp_bnm_downloads")
+SCRAPE_CACHE_PATH = Path("cron_status_cache.pkl")
+SCRAPE_CACHE_MAX_AGE = timedelta(hours=12)  # force a full scrape even if BNM's validators never change
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+INSERT_CHUNK_SIZE = 500  # rows per insert, keeps PostgREST payloads bounded
+EXISTS_CHUNK_SIZE = 50  # titles per in_() filter, keeps the query URL short
+SELECT_PAGE_SIZE = 1000  # PostgREST's default max rows per response
+REDIS_URL = os.getenv("REDIS_URL")
+CRON_STATUS_KEY = "bnm_cron:status"
+CRON_LOCK_KEY = "bnm_cron:lock"
+CRON_LOCK_TTL = 600  # seconds; refreshed every third of this while a run is alive
+MAX_CONCURRENT_DOCUMENTS = 3  # matches the OCR webhook's concurrent call limit
+OCR_MAX_RATE = 5  # OCR webhook requests per second
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+EMBEDDING_MAX_BATCH_INPUTS = 2048  # inputs per embeddings request accepted by the API
+EMBEDDING_MAX_INPUT_TOKENS = 8191  # per-input limit of the embedding model
+EMBEDDING_MAX_BATCH_TOKENS = 250_000  # stays under the 300k tokens/request API cap
+BATCH_API_MIN_PAGES = 50  # smaller runs embed synchronously
+BATCH_POLL_INTERVAL = 60  # seconds between Batch API status checks
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
 
 # Initialize clients
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)  # retry_transient is the only retry layer
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# One HTTP/2 connection to the OCR webhook, reused by every document
+ocr_client = httpx.Client(
+    http2=True,
+    timeout=180,
+    limits=httpx.Limits(max_keepalive_connections=MAX_CONCURRENT_DOCUMENTS)
+)
+# Keeps concurrent documents from bursting the n8n webhook
+ocr_limiter = AsyncLimiter(OCR_MAX_RATE, 1)
+
+# Shared cron status across workers, only when Redis is configured
+redis_client = None
+if REDIS_URL:
+    import redis.asyncio as redis
+    redis_client = redis.from_url(REDIS_URL)
+
+
+@dataclass(frozen=True)
+class CronStatus:
+    """Immutable snapshot of the cron job status."""
+    __slots__ = ("last_run", "status", "new_documents", "processed", "failed", "message")
+    last_run: Optional[str]
+    status: str
+    new_documents: int
+    processed: int
+    failed: int
+    message: str
 
-# Global state for cron job status
-cron_status = {
-    "last_run": None,
-    "status": "idle",
-    "new_documents": 0,
-    "processed": 0,
-    "failed": 0,
-    "message": "Not run yet"
-}
+
+# Global state for cron job status, only ever rebound to a new snapshot
+cron_status = CronStatus(
+    last_run=None,
+    status="idle",
+    new_documents=0,
+    processed=0,
+    failed=0,
+    message="Not run yet"
+)
 
 
 # Pydantic models
@@ -97,116 +173,460 @@ class StatusResponse(BaseModel):
 
 
 # Helper functions
-def check_if_exists(title: str, date: str) -> bool:
-    """Check if document already exists in database."""
-    try:
-        result = supabase.table(TABLE_NAME).select("id").eq("title", title).eq("date", date).limit(1).execute()
-        return len(result.data) > 0
-    except:
-        return False
+async def set_cron_status(**changes):
+    """
+    Publish a new cron status snapshot.
+    
+    The global is rebound to a fresh CronStatus, so readers never observe a
+    half-applied update. With Redis configured, the snapshot is also written
+    there for every worker to read.
+    """
+    global cron_status
+    
+    cron_status = replace(cron_status, **changes)
+    
+    if redis_client:
+        try:
+            await redis_client.set(CRON_STATUS_KEY, orjson.dumps(asdict(cron_status)))
+        except Exception as e:
+            print(f"[ERROR] Publishing cron status failed: {str(e)}")
+
+
+async def get_shared_cron_status() -> CronStatus:
+    """
+    Read the latest cron status, from Redis when configured.
+    
+    A "running" snapshot whose run lock has expired belongs to a worker
+    that died mid-run, and is reported as an error.
+    """
+    if redis_client:
+        try:
+            raw = await redis_client.get(CRON_STATUS_KEY)
+            if raw:
+                status = CronStatus(**orjson.loads(raw))
+                if status.status == "running" and not await redis_client.exists(CRON_LOCK_KEY):
+                    status = replace(status, status="error", message="Run was interrupted before completing")
+                return status
+        except Exception as e:
+            print(f"[ERROR] Reading cron status failed: {str(e)}")
+    
+    return cron_status
+
+
+# Only touch the lock while it still holds this run's token
+_REFRESH_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+async def acquire_run_lock() -> Optional[str]:
+    """Take the cross-worker run lock, returning its token or None if a run holds it."""
+    token = uuid.uuid4().hex
+    if await redis_client.set(CRON_LOCK_KEY, token, nx=True, ex=CRON_LOCK_TTL):
+        return token
+    return None
+
 
+async def keep_run_lock(token: str):
+    """Extend the run lock until cancelled, so only a crashed run lets it expire."""
+    while True:
+        await asyncio.sleep(CRON_LOCK_TTL / 3)
+        try:
+            await redis_client.eval(_REFRESH_LOCK_SCRIPT, 1, CRON_LOCK_KEY, token, CRON_LOCK_TTL)
+        except Exception as e:
+            print(f"[ERROR] Refreshing cron lock failed: {str(e)}")
 
-async def scrape_bnm_announcements() -> pd.DataFrame:
-    """Scrape BNM website for announcements."""
+
+async def release_run_lock(token: str):
+    """Release the run lock if this run still owns it."""
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=["--no-sandbox", "--disable-dev-shm-usage"]
+        await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, CRON_LOCK_KEY, token)
+    except Exception as e:
+        print(f"[ERROR] Releasing cron lock failed: {str(e)}")
+
+
+def fetch_existing_keys(titles: List[str]) -> set:
+    """
+    Fetch the (title, date) keys already stored for the given titles.
+    
+    Titles are queried in chunks of EXISTS_CHUNK_SIZE, and each chunk is
+    paged since the table holds one row per document page. Errors are
+    raised: treating a failed lookup as "nothing exists" would reprocess
+    every document.
+    """
+    existing = set()
+    
+    for i in range(0, len(titles), EXISTS_CHUNK_SIZE):
+        chunk = titles[i:i + EXISTS_CHUNK_SIZE]
+        start = 0
+        
+        while True:
+            result = (
+                supabase.table(TABLE_NAME)
+                .select("title,date")
+                .order("id")
+                .in_("title", chunk)
+                .range(start, start + SELECT_PAGE_SIZE - 1)
+                .execute()
             )
+            existing.update((row['title'], row['date']) for row in result.data)
             
-            page = await browser.new_page(
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            )
+            if len(result.data) < SELECT_PAGE_SIZE:
+                break
+            start += SELECT_PAGE_SIZE
+    
+    return existing
+
+
+def insert_rows(rows: List[Dict]) -> int:
+    """
+    Insert rows in one request, falling back to per-row inserts if PostgREST rejects the batch.
+    
+    Pages already stored are skipped server-side (ON CONFLICT DO NOTHING),
+    so overlapping cron runs cannot duplicate a document.
+    """
+    try:
+        supabase.table(TABLE_NAME).upsert(rows, on_conflict=PAGE_CONFLICT_KEY, ignore_duplicates=True).execute()
+        return len(rows)
+    except APIError as e:
+        print(f"[ERROR] Batch insert failed, retrying per row: {str(e)}")
+    
+    inserted = 0
+    for row in rows:
+        try:
+            supabase.table(TABLE_NAME).upsert(row, on_conflict=PAGE_CONFLICT_KEY, ignore_duplicates=True).execute()
+            inserted += 1
+        except Exception as e:
+            print(f"[ERROR] Failed to store page: {str(e)}")
+    
+    return inserted
+
+
+def load_scrape_cache() -> Optional[Dict]:
+    """Load the announcements table saved by the last successful scrape."""
+    try:
+        with open(SCRAPE_CACHE_PATH, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def save_scrape_cache(df: pd.DataFrame, validators: Dict[str, str]):
+    """Save the scraped table with the validators needed for conditional requests."""
+    cache = {
+        "df": df,
+        "etag": validators.get("etag"),
+        "last_modified": validators.get("last-modified"),
+        "scraped_at": datetime.now(timezone.utc)
+    }
+    
+    try:
+        tmp_path = SCRAPE_CACHE_PATH.with_suffix(".tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(cache, f)
+        tmp_path.replace(SCRAPE_CACHE_PATH)
+    except Exception as e:
+        print(f"[ERROR] Saving scrape cache failed: {str(e)}")
+
+
+async def check_bnm_unchanged(http_client: httpx.AsyncClient, cache: Optional[Dict]) -> Tuple[bool, Dict[str, str]]:
+    """
+    Ask BNM whether the announcements page changed since the cached scrape.
+    
+    Returns whether the cached table can be reused, plus the validators
+    (ETag / Last-Modified) of the current page. A cache older than
+    SCRAPE_CACHE_MAX_AGE is never reused.
+    """
+    # The table rows are drawn by DataTables, possibly from a separate
+    # source, so the page's validators alone can't be trusted forever
+    if cache and datetime.now(timezone.utc) - cache["scraped_at"] > SCRAPE_CACHE_MAX_AGE:
+        cache = None
+    
+    headers = {"User-Agent": USER_AGENT}
+    if cache:
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        headers["If-Modified-Since"] = cache.get("last_modified") or format_datetime(cache["scraped_at"], usegmt=True)
+    
+    try:
+        response = await http_client.head(BNM_URL, headers=headers)
+    except httpx.HTTPError:
+        return False, {}
+    
+    validators = {
+        key: response.headers[key]
+        for key in ("etag", "last-modified")
+        if key in response.headers
+    }
+    
+    if not cache:
+        return False, validators
+    
+    if response.status_code == 304:
+        return True, validators
+    
+    last_modified = response.headers.get("last-modified")
+    if response.status_code == 200 and last_modified:
+        try:
+            if parsedate_to_datetime(last_modified) <= cache["scraped_at"]:
+                return True, validators
+        except (TypeError, ValueError):
+            pass
+    
+    return False, validators
+
+
+def absolute_bnm_url(href: str) -> str:
+    """Resolve a site-relative BNM link."""
+    return href if href.startswith("http") else "https://www.bnm.gov.my" + href
+
+
+def _text_nodes(node: Node):
+    """Yield the text nodes under a node, in document order."""
+    for child in node.iter(include_text=True):
+        if child.tag == "-text":
+            yield child.text_content
+        else:
+            yield from _text_nodes(child)
+
+
+def node_text(node: Node, sep: str = "") -> str:
+    """Join a node's stripped, non-empty text nodes (BeautifulSoup's get_text(sep, strip=True))."""
+    return sep.join(text for text in (t.strip() for t in _text_nodes(node)) if text)
+
+
+def announcements_frame(cells: List[List[Node]]) -> pd.DataFrame:
+    """
+    Build the announcements table from (date, title, type) cells per row.
+    
+    Columns are extracted as flat lists and the DataFrame is built once;
+    links come from the anchors in the title cell.
+    """
+    return pd.DataFrame({
+        "date": [node_text(tds[0]) for tds in cells],
+        "title": [node_text(tds[1], " ") for tds in cells],
+        "type": [node_text(tds[2]) for tds in cells],
+        "links": [
+            [absolute_bnm_url(a.attributes["href"] or "") for a in tds[1].css("a[href]")]
+            for tds in cells
+        ]
+    })
+
+
+async def fetch_announcements_json(http_client: httpx.AsyncClient) -> pd.DataFrame:
+    """
+    Fetch the announcements straight from the DataTable's AJAX source.
+    
+    Accepts both DataTables row formats: arrays of cell HTML
+    (date, title, type) or objects keyed by column name.
+    """
+    response = await http_client.get(
+        BNM_DATATABLE_URL,
+        params={"draw": 1, "start": 0, "length": BNM_TABLE_LENGTH},
+        headers={"User-Agent": USER_AGENT, "X-Requested-With": "XMLHttpRequest", "Referer": BNM_URL}
+    )
+    response.raise_for_status()
+    payload = response.json()
+    
+    cells = []
+    for record in payload["data"] if isinstance(payload, dict) else payload:
+        if isinstance(record, dict):
+            record = [record["date"], record["title"], record["type"]]
+        cells.append([HTMLParser(str(cell)).body for cell in record[:3]])
+    
+    return announcements_frame(cells)
+
+
+async def scrape_bnm_announcements(browser: Browser, http_client: httpx.AsyncClient) -> pd.DataFrame:
+    """Scrape BNM website for announcements, reusing the cached table if unchanged."""
+    cache = load_scrape_cache()
+    unchanged, validators = await check_bnm_unchanged(http_client, cache)
+    if unchanged:
+        return cache["df"]
+    
+    # Cheap path: read the table's JSON source, no browser needed
+    if BNM_DATATABLE_URL:
+        try:
+            df = await fetch_announcements_json(http_client)
+            if not df.empty:
+                save_scrape_cache(df, validators)
+                return df
+        except Exception as e:
+            print(f"[ERROR] DataTable endpoint failed, falling back to browser: {str(e)}")
+    
+    try:
+        context = await browser.new_context(
+            user_agent=USER_AGENT
+        )
+        
+        try:
+            page = await context.new_page()
             
             await page.goto(BNM_URL, wait_until="networkidle", timeout=60000)
             await page.wait_for_selector("table#filta", timeout=60000)
             
             # Set table to show all entries
             await page.evaluate("""
-                () => {
+                (length) => {
                     const table = $('#filta').DataTable();
-                    table.page.len(149).draw();
+                    table.page.len(length).draw();
                 }
-            """)
+            """, BNM_TABLE_LENGTH)
             
             await page.wait_for_timeout(3000)
             
             html = await page.content()
-            await browser.close()
+        finally:
+            await context.close()
         
         # Parse HTML
-        soup = BeautifulSoup(html, "html.parser")
-        table = soup.find("table", id="filta")
+        tree = HTMLParser(html)
+        df = announcements_frame([tr.css("td") for tr in tree.css("table#filta tbody tr")])
+        if not df.empty:
+            save_scrape_cache(df, validators)
         
-        rows = []
-        for tr in table.select("tbody tr"):
-            tds = tr.find_all("td")
-            rows.append({
-                "date": tds[0].get_text(strip=True),
-                "title": tds[1].get_text(" ", strip=True),
-                "type": tds[2].get_text(strip=True),
-                "links": [
-                    a["href"] if a["href"].startswith("http")
-                    else "https://www.bnm.gov.my" + a["href"]
-                    for a in tds[1].find_all("a", href=True)
-                ]
-            })
-        
-        return pd.DataFrame(rows)
+        return df
         
     except Exception as e:
         print(f"[ERROR] Scraping failed: {str(e)}")
         return pd.DataFrame()
 
 
-async def download_pdf(url: str) -> Optional[Path]:
-    """Download PDF using Playwright."""
+async def download_pdf_with_browser(browser: Browser, url: str, filepath: Path) -> bool:
+    """Download PDF using a fresh context on the shared browser."""
+    context = await browser.new_context(accept_downloads=True)
+    page = await context.new_page()
+    
+    try:
+        async with page.expect_download(timeout=30000) as download_info:
+            await page.goto(url, wait_until="networkidle", timeout=30000)
+        
+        download = await download_info.value
+        await download.save_as(filepath)
+        return True
+        
+    except Exception as e:
+        print(f"[ERROR] Browser download failed: {str(e)}")
+        return False
+        
+    finally:
+        await context.close()
+
+
+async def download_pdf(browser: Browser, http_client: httpx.AsyncClient, url: str) -> Optional[Path]:
+    """
+    Download PDF by streaming a plain GET to disk.
+    
+    Falls back to the browser when the server answers with an error status
+    or something other than a PDF (e.g. a 403/503 challenge page).
+    """
+    filepath = None
+    
     try:
         DOWNLOAD_DIR.mkdir(exist_ok=True)
         
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True, args=['--no-sandbox'])
-            context = await browser.new_context(accept_downloads=True)
-            page = await context.new_page()
+        # Documents are prepared concurrently and PDFs often share a
+        # basename, so every download gets its own file
+        stem = Path(urlparse(url).path).stem or "download"
+        fd, path = tempfile.mkstemp(dir=DOWNLOAD_DIR, prefix=f"{stem}_", suffix=".pdf")
+        os.close(fd)
+        filepath = Path(path)
+        
+        async with http_client.stream("GET", url) as response:
+            is_pdf = (
+                response.is_success
+                and response.headers.get("content-type", "").startswith("application/pdf")
+            )
             
-            try:
-                async with page.expect_download(timeout=30000) as download_info:
-                    await page.goto(url, wait_until="networkidle", timeout=30000)
-                
-                download = await download_info.value
-                filename = url.split('/')[-1]
-                if not filename.endswith('.pdf'):
-                    filename += '.pdf'
-                
-                filepath = DOWNLOAD_DIR / filename
-                await download.save_as(filepath)
-                
-                if filepath.stat().st_size < 1000:
-                    filepath.unlink()
-                    await browser.close()
-                    return None
-                
-                await browser.close()
-                return filepath
-                
-            except:
-                await browser.close()
-                return None
-                
-    except:
+            if is_pdf:
+                with open(filepath, 'wb') as f:
+                    async for chunk in response.aiter_bytes(65536):
+                        f.write(chunk)
+        
+        if not is_pdf and not await download_pdf_with_browser(browser, url, filepath):
+            filepath.unlink(missing_ok=True)
+            return None
+        
+        if filepath.stat().st_size < 1000:
+            filepath.unlink()
+            return None
+        
+        return filepath
+        
+    except Exception as e:
+        print(f"[ERROR] Download failed: {str(e)}")
+        if filepath:
+            filepath.unlink(missing_ok=True)
         return None
 
 
-def extract_text_from_pdf(pdf_path: Path) -> Optional[Dict]:
+def is_retryable_error(exc: BaseException) -> bool:
+    """Retry OCR and OpenAI calls on throttling, transient server errors and dropped connections."""
+    if isinstance(exc, (RateLimitError, APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in RETRYABLE_STATUS_CODES
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+
+# Up to 3 retries, waiting 1s, 2s, then 4s
+retry_transient = retry(
+    retry=retry_if_exception(is_retryable_error),
+    wait=wait_exponential(multiplier=1, min=1, max=4),
+    stop=stop_after_attempt(4),
+    reraise=True
+)
+
+
+def is_retryable_status(exc: BaseException) -> bool:
+    """Retry only requests the server rejected; a timeout may have been accepted."""
+    return isinstance(exc, APIStatusError) and exc.status_code in RETRYABLE_STATUS_CODES
+
+
+# For calls that create billed resources: a blind retry after a timeout
+# could upload a second file or start a second batch
+retry_rejected = retry(
+    retry=retry_if_exception(is_retryable_status),
+    wait=wait_exponential(multiplier=1, min=1, max=4),
+    stop=stop_after_attempt(4),
+    reraise=True
+)
+
+
+def post_pdf_to_ocr(pdf_path: Path):
+    """Send a PDF to the OCR webhook and return the parsed response."""
+    # Pass the open handle, not its bytes: httpx sizes it with fstat and
+    # streams the multipart body in 64KB reads
+    with open(pdf_path, 'rb') as f:
+        files = {'data': (pdf_path.name, f, 'application/pdf')}
+        response = ocr_client.post(OCR_WEBHOOK_URL, files=files)
+    
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+
+@retry_transient
+async def request_ocr(pdf_path: Path):
+    """Make one OCR webhook call, paced by the shared rate limiter."""
+    async with ocr_limiter:
+        return await asyncio.to_thread(post_pdf_to_ocr, pdf_path)
+
+
+async def extract_text_from_pdf(pdf_path: Path) -> Optional[Dict]:
     """Extract text via n8n OCR webhook."""
     try:
-        with open(pdf_path, 'rb') as f:
-            files = {'data': (pdf_path.name, f, 'application/pdf')}
-            response = requests.post(OCR_WEBHOOK_URL, files=files, timeout=180)
-        
-        response.raise_for_status()
-        ocr_data = response.json()
+        ocr_data = await request_ocr(pdf_path)
         
         if isinstance(ocr_data, list) and len(ocr_data) > 0:
             ocr_data = ocr_data[0]
@@ -217,37 +637,254 @@ def extract_text_from_pdf(pdf_path: Path) -> Optional[Dict]:
         return None
 
 
+@lru_cache(maxsize=1)
+def embedding_encoding() -> tiktoken.Encoding:
+    """Load the tokenizer for the embedding model once."""
+    return tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+
+def count_embedding_tokens(text: str) -> int:
+    """Count tokens, encoding strings like <|endoftext|> in OCR text as plain text."""
+    return len(embedding_encoding().encode(text, disallowed_special=()))
+
+
+def clean_embedding_text(text: str) -> str:
+    """Flatten newlines and clip text to the embedding input token limit."""
+    cleaned = text.replace("\n", " ").strip()
+    # A token is at least one UTF-8 byte, so short text needs no encoding
+    if len(cleaned.encode("utf-8")) > EMBEDDING_MAX_INPUT_TOKENS:
+        tokens = embedding_encoding().encode(cleaned, disallowed_special=())
+        if len(tokens) > EMBEDDING_MAX_INPUT_TOKENS:
+            cleaned = embedding_encoding().decode(tokens[:EMBEDDING_MAX_INPUT_TOKENS])
+    return cleaned
+
+
+@retry_transient
 def get_embeddings_batch(texts: List[str]) -> List[List[float]]:
-    """Generate embeddings in batch."""
-    cleaned_texts = []
-    for text in texts:
-        cleaned = text.replace("\n", " ").strip()
-        if len(cleaned) > 8000:
-            cleaned = cleaned[:8000]
-        cleaned_texts.append(cleaned)
+    """Generate embeddings in batch, sending each distinct text once."""
+    cleaned_texts = [clean_embedding_text(text) for text in texts]
+    unique_texts = list(dict.fromkeys(cleaned_texts))
+    index = {text: i for i, text in enumerate(unique_texts)}
     
     response = openai_client.embeddings.create(
-        input=cleaned_texts,
+        input=unique_texts,
         model=EMBEDDING_MODEL,
         dimensions=EMBEDDING_DIMENSIONS
     )
     
-    return [item.embedding for item in response.data]
+    return [response.data[index[text]].embedding for text in cleaned_texts]
+
+
+def pack_embedding_batches(items: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """Group (custom_id, text) pairs into batches within the embeddings request limits."""
+    batches = []
+    batch = []
+    batch_tokens = 0
+    
+    for custom_id, text in items:
+        text_tokens = count_embedding_tokens(clean_embedding_text(text))
+        if batch and (len(batch) == EMBEDDING_MAX_BATCH_INPUTS
+                      or batch_tokens + text_tokens > EMBEDDING_MAX_BATCH_TOKENS):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append((custom_id, text))
+        batch_tokens += text_tokens
+    
+    if batch:
+        batches.append(batch)
+    
+    return batches
+
+
+def compact_embedding(embedding: List[float]) -> List[float]:
+    """Round an embedding for the insert payload; pgvector keeps float32 anyway."""
+    return [round(x, EMBEDDING_DECIMALS) for x in embedding]
+
+
+def embed_pages_sync(items: List[Tuple[str, str]]) -> Dict[str, List[float]]:
+    """
+    Embed (custom_id, text) pairs with the synchronous endpoint.
+    
+    A failed request is logged and its pages are left out of the result,
+    so only the documents they belong to fail to store.
+    """
+    embeddings = {}
+    
+    for batch in pack_embedding_batches(items):
+        try:
+            vectors = get_embeddings_batch([text for _, text in batch])
+        except Exception as e:
+            print(f"[ERROR] Embedding failed for {len(batch)} pages: {str(e)}")
+            continue
+        for (custom_id, _), vector in zip(batch, vectors):
+            embeddings[custom_id] = vector
+    
+    return embeddings
+
+
+async def embed_pages_with_batch_api(items: List[Tuple[str, str]]) -> Dict[str, List[float]]:
+    """
+    Embed (custom_id, text) pairs through the OpenAI Batch API.
+    
+    Uploads one JSONL request per page, waits for the batch to finish and
+    returns the embeddings keyed by custom_id. Pages whose request failed
+    inside the batch are re-embedded through the synchronous endpoint.
+    """
+    lines = [
+        json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/embeddings",
+            "body": {
+                "model": EMBEDDING_MODEL,
+                "input": clean_embedding_text(text),
+                "dimensions": EMBEDDING_DIMENSIONS
+            }
+        })
+        for custom_id, text in items
+    ]
+    
+    batch_file = await asyncio.to_thread(
+        retry_rejected(openai_client.files.create),
+        file=("bnm_embeddings.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = await asyncio.to_thread(
+        retry_rejected(openai_client.batches.create),
+        input_file_id=batch_file.id,
+        endpoint="/v1/embeddings",
+        completion_window="24h"
+    )
+    await set_cron_status(message=f"Waiting for embedding batch {batch.id} ({len(items)} pages)")
+    
+    while batch.status not in BATCH_FINAL_STATUSES:
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        batch = await asyncio.to_thread(retry_transient(openai_client.batches.retrieve), batch.id)
+    
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Embedding batch {batch.id} ended with status {batch.status}")
+    
+    embeddings = {}
+    output = (await asyncio.to_thread(retry_transient(openai_client.files.content), batch.output_file_id)).text
+    
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            print(f"[ERROR] Embedding failed for page {result.get('custom_id')}: {result.get('error')}")
+            continue
+        embeddings[result["custom_id"]] = response["body"]["data"][0]["embedding"]
+    
+    missing = [(custom_id, text) for custom_id, text in items if custom_id not in embeddings]
+    if missing:
+        print(f"[ERROR] Batch {batch.id} missed {len(missing)} pages, embedding them synchronously")
+        embeddings.update(await asyncio.to_thread(embed_pages_sync, missing))
+    
+    return embeddings
+
+
+def embedding_cache_key(text: str) -> str:
+    """SHA-256 of the text as embedded, scoped to the embedding model and size."""
+    payload = f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}:{clean_embedding_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def fetch_cached_embeddings(hashes: List[str]) -> Dict[str, List[float]]:
+    """Look up previously computed embeddings by content hash."""
+    cached = {}
+    
+    try:
+        for i in range(0, len(hashes), EXISTS_CHUNK_SIZE):
+            result = (
+                supabase.table(EMBEDDING_CACHE_TABLE)
+                .select("content_hash,embedding")
+                .in_("content_hash", hashes[i:i + EXISTS_CHUNK_SIZE])
+                .execute()
+            )
+            
+            for row in result.data:
+                embedding = row["embedding"]
+                # pgvector columns come back as their text form
+                cached[row["content_hash"]] = orjson.loads(embedding) if isinstance(embedding, str) else embedding
+    except Exception as e:
+        print(f"[ERROR] Embedding cache lookup failed: {str(e)}")
+    
+    return cached
+
+
+def cache_embeddings(entries: Dict[str, List[float]]):
+    """Save new embeddings to the cache, keeping whichever copy landed first."""
+    rows = [{"content_hash": h, "embedding": compact_embedding(embedding)} for h, embedding in entries.items()]
+    
+    try:
+        for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+            (
+                supabase.table(EMBEDDING_CACHE_TABLE)
+                .upsert(rows[i:i + INSERT_CHUNK_SIZE], on_conflict="content_hash", ignore_duplicates=True)
+                .execute()
+            )
+    except Exception as e:
+        print(f"[ERROR] Embedding cache update failed: {str(e)}")
+
+
+async def embed_pages(items: List[Tuple[str, str]]) -> Dict[str, List[float]]:
+    """Embed all pages of a run, reusing cached embeddings and using the Batch API for large runs."""
+    hashes = {custom_id: embedding_cache_key(text) for custom_id, text in items}
+    cached = await asyncio.to_thread(fetch_cached_embeddings, list(set(hashes.values())))
+    
+    # Embed one page per distinct uncached text
+    pending = {}
+    for custom_id, text in items:
+        if hashes[custom_id] not in cached:
+            pending.setdefault(hashes[custom_id], (custom_id, text))
+    misses = list(pending.values())
+    
+    if not misses:
+        fresh = {}
+    elif len(misses) < BATCH_API_MIN_PAGES:
+        fresh = await asyncio.to_thread(embed_pages_sync, misses)
+    else:
+        try:
+            fresh = await embed_pages_with_batch_api(misses)
+        except Exception as e:
+            print(f"[ERROR] Batch embedding failed, falling back to sync: {str(e)}")
+            fresh = await asyncio.to_thread(embed_pages_sync, misses)
+    
+    if fresh:
+        fresh = {hashes[custom_id]: embedding for custom_id, embedding in fresh.items()}
+        await asyncio.to_thread(cache_embeddings, fresh)
+        cached.update(fresh)
+    
+    return {
+        custom_id: cached[h]
+        for custom_id, h in hashes.items()
+        if h in cached
+    }
 
 
-async def process_new_document(date: str, title: str, doc_type: str, pdf_url: str) -> bool:
-    """Process a new document through the full pipeline."""
+async def prepare_document(
+    browser: Browser,
+    http_client: httpx.AsyncClient,
+    date: str,
+    title: str,
+    doc_type: str,
+    pdf_url: str
+) -> Optional[Dict]:
+    """Download and OCR a new document, returning its pages ready to embed."""
     try:
         # Download PDF
-        pdf_path = await download_pdf(pdf_url)
+        pdf_path = await download_pdf(browser, http_client, pdf_url)
         if not pdf_path:
-            return False
+            return None
         
         # Extract text via OCR
-        ocr_data = extract_text_from_pdf(pdf_path)
+        ocr_data = await extract_text_from_pdf(pdf_path)
+        pdf_path.unlink()
         if not ocr_data:
-            pdf_path.unlink()
-            return False
+            return None
         
         # Prepare page data
         pages = ocr_data.get('pages', [])
@@ -263,144 +900,247 @@ async def process_new_document(date: str, title: str, doc_type: str, pdf_url: st
             page_data_list.append({
                 'page_number': page_number,
                 'content': markdown_content,
-                'original_text': ocr_data.get('extractedText', ''),
                 'page_info': page
             })
         
         if not page_data_list:
-            pdf_path.unlink()
-            return False
-        
-        # Generate embeddings in batches
-        all_embeddings = []
-        batch_size = 10
-        
-        for i in range(0, len(page_data_list), batch_size):
-            batch = page_data_list[i:i + batch_size]
-            texts = [p['content'] for p in batch]
-            embeddings = get_embeddings_batch(texts)
-            all_embeddings.extend(embeddings)
-        
-        # Store in Supabase
-        for page_data, embedding in zip(page_data_list, all_embeddings):
-            try:
-                source_metadata = {
-                    "scraped_date": date,
-                    "scraped_title": title,
-                    "scraped_type": doc_type,
-                    "source": "BNM Website - Daily Cron",
-                    "source_url": BNM_URL,
-                    "scraped_at": datetime.utcnow().isoformat()
-                }
-                
-                metadata = {
-                    "date": date,
-                    "title": title,
-                    "type": doc_type,
-                    "page_number": page_data['page_number'],
-                    "total_pages": len(pages),
-                    "model": ocr_data.get('model', 'mistral-ocr'),
-                    "header": page_data['page_info'].get('header', ''),
-                    "footer": page_data['page_info'].get('footer', ''),
-                    "dimensions": page_data['page_info'].get('dimensions', {}),
-                    "tables_count": len(page_data['page_info'].get('tables', [])),
-                    "images_count": len(page_data['page_info'].get('images', [])),
-                    "hyperlinks_count": len(page_data['page_info'].get('hyperlinks', [])),
-                    "processed_at": datetime.utcnow().isoformat()
-                }
-                
-                data = {
-                    "date": date,
-                    "title": title,
-                    "type": doc_type,
-                    "pdf_url": pdf_url,
-                    "page_number": page_data['page_number'],
-                    "content": page_data['content'],
-                    "original_text": page_data['original_text'],
-                    "source_metadata": source_metadata,
-                    "metadata": metadata,
-                    "embedding": embedding
-                }
-                
-                supabase.table(TABLE_NAME).insert(data).execute()
-                
-            except Exception as e:
-                print(f"[ERROR] Failed to store page: {str(e)}")
-        
-        # Clean up
-        pdf_path.unlink()
+            return None
         
-        return True
+        return {
+            "date": date,
+            "title": title,
+            "type": doc_type,
+            "pdf_url": pdf_url,
+            "ocr_data": ocr_data,
+            "original_text": ocr_data.get('extractedText', ''),
+            "total_pages": len(pages),
+            "pages": page_data_list
+        }
         
     except Exception as e:
         print(f"[ERROR] Processing failed: {str(e)}")
+        return None
+
+
+def store_document(doc: Dict, embeddings: List[Optional[List[float]]]) -> bool:
+    """
+    Insert the embedded pages of a prepared document into Supabase.
+    
+    Returns True only if every page was embedded and inserted; a partial
+    document is never reported as processed.
+    """
+    date = doc["date"]
+    title = doc["title"]
+    
+    if any(embedding is None for embedding in embeddings):
+        print(f"[ERROR] Missing embeddings for {title}, not storing it")
         return False
+    
+    doc_type = doc["type"]
+    ocr_data = doc["ocr_data"]
+    total_pages = doc["total_pages"]
+    
+    source_metadata = {
+        "scraped_date": date,
+        "scraped_title": title,
+        "scraped_type": doc_type,
+        "source": "BNM Website - Daily Cron",
+        "source_url": BNM_URL,
+        "scraped_at": datetime.utcnow().isoformat()
+    }
+    
+    rows = [
+        {
+            "date": date,
+            "title": title,
+            "type": doc_type,
+            "pdf_url": doc["pdf_url"],
+            "page_number": page_data['page_number'],
+            "content": page_data['content'],
+            "original_text": None,
+            "source_metadata": source_metadata,
+            "metadata": {
+                "date": date,
+                "title": title,
+                "type": doc_type,
+                "page_number": page_data['page_number'],
+                "total_pages": total_pages,
+                "model": ocr_data.get('model', 'mistral-ocr'),
+                "header": page_data['page_info'].get('header', ''),
+                "footer": page_data['page_info'].get('footer', ''),
+                "dimensions": page_data['page_info'].get('dimensions', {}),
+                "tables_count": len(page_data['page_info'].get('tables', [])),
+                "images_count": len(page_data['page_info'].get('images', [])),
+                "hyperlinks_count": len(page_data['page_info'].get('hyperlinks', [])),
+                "processed_at": datetime.utcnow().isoformat()
+            },
+            "embedding": compact_embedding(embedding)
+        }
+        for page_data, embedding in zip(doc["pages"], embeddings)
+    ]
+    
+    # Full document text is stored once, on the first page row
+    rows[0]["original_text"] = doc["original_text"]
+    
+    inserted = 0
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        inserted += insert_rows(rows[i:i + INSERT_CHUNK_SIZE])
+    
+    return inserted == len(doc["pages"])
 
 
-async def run_daily_scrape():
-    """Main cron job function."""
-    global cron_status
+async def scrape_and_prepare(
+    browser: Browser,
+    http_client: httpx.AsyncClient
+) -> Optional[Tuple[List[Dict], int]]:
+    """
+    Scrape BNM, then download and OCR the new documents with the shared clients.
     
-    cron_status["status"] = "running"
-    cron_status["last_run"] = datetime.now().isoformat()
-    cron_status["new_documents"] = 0
-    cron_status["processed"] = 0
-    cron_status["failed"] = 0
+    Returns the prepared documents and the number that failed, or None if
+    nothing was scraped.
+    """
+    # Scrape BNM website
+    df = await scrape_bnm_announcements(browser, http_client)
     
-    try:
-        # Scrape BNM website
-        df = await scrape_bnm_announcements()
-        
-        if df.empty:
-            cron_status["status"] = "completed"
-            cron_status["message"] = "No data scraped from BNM website"
-            return
+    if df.empty:
+        await set_cron_status(status="completed", message="No data scraped from BNM website")
+        return None
+    
+    # Check for new documents
+    existing = await asyncio.to_thread(fetch_existing_keys, df["title"].unique().tolist())
+    is_new = df.apply(lambda r: (r["title"], r["date"]) not in existing, axis=1)
+    new_df = df[is_new]
+    await set_cron_status(new_documents=len(new_df))
+    
+    new_docs = []
+    
+    for idx, row in new_df.iterrows():
+        date = row['date']
+        title = row['title']
+        doc_type = row['type']
+        links = row['links']
         
-        # Check for new documents
-        new_docs = []
+        # Get PDF links
+        pdf_links = [link for link in links if link.endswith('.pdf')]
         
-        for idx, row in df.iterrows():
-            date = row['date']
-            title = row['title']
-            doc_type = row['type']
-            links = row['links']
-            
-            # Check if already exists
-            if check_if_exists(title, date):
-                continue
-            
-            # New document found
-            cron_status["new_documents"] += 1
-            
-            # Get PDF links
-            pdf_links = [link for link in links if link.endswith('.pdf')]
+        for pdf_url in pdf_links:
+            new_docs.append((date, title, doc_type, pdf_url))
+    
+    # Download and OCR new documents, a few at a time
+    sem = asyncio.Semaphore(MAX_CONCURRENT_DOCUMENTS)
+    
+    async def _run(doc):
+        async with sem:
+            return await prepare_document(browser, http_client, *doc)
+    
+    results = await asyncio.gather(*(_run(doc) for doc in new_docs), return_exceptions=True)
+    
+    prepared = []
+    failed = 0
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"[ERROR] {str(result)}")
+            failed += 1
+        elif result:
+            prepared.append(result)
+        else:
+            failed += 1
+    await set_cron_status(failed=failed)
+    
+    return prepared, failed
+
+
+async def embed_and_store(prepared: List[Dict], failed: int):
+    """Embed every page of the prepared documents, then store them."""
+    # Embed every page of the run in one go
+    items = [
+        (f"{doc_idx}:{page_idx}", page_data['content'])
+        for doc_idx, doc in enumerate(prepared)
+        for page_idx, page_data in enumerate(doc["pages"])
+    ]
+    embeddings = await embed_pages(items) if items else {}
+    
+    # Store in Supabase, a few documents at a time
+    sem = asyncio.Semaphore(MAX_CONCURRENT_DOCUMENTS)
+    
+    async def _store(doc_idx, doc):
+        async with sem:
+            return await asyncio.to_thread(store_document, doc, [
+                embeddings.get(f"{doc_idx}:{page_idx}")
+                for page_idx in range(len(doc["pages"]))
+            ])
+    
+    stored = await asyncio.gather(
+        *(_store(doc_idx, doc) for doc_idx, doc in enumerate(prepared)),
+        return_exceptions=True
+    )
+    
+    processed = 0
+    for result in stored:
+        if isinstance(result, Exception):
+            print(f"[ERROR] Storing failed: {str(result)}")
+            failed += 1
+        elif result:
+            processed += 1
+        else:
+            failed += 1
+    
+    # Update status
+    await set_cron_status(
+        status="completed",
+        processed=processed,
+        failed=failed,
+        message=f"Processed {processed} new documents, {failed} failed"
+    )
+
+
+async def run_daily_scrape(lock_token: Optional[str] = None):
+    """Main cron job function, holding the Redis run lock when given its token."""
+    lock_keeper = asyncio.create_task(keep_run_lock(lock_token)) if lock_token else None
+    
+    try:
+        await _run_daily_scrape()
+    finally:
+        if lock_keeper:
+            lock_keeper.cancel()
+            await release_run_lock(lock_token)
+
+
+async def _run_daily_scrape():
+    """Run one scrape with its own browser and HTTP/2 pool."""
+    await set_cron_status(
+        status="running",
+        last_run=datetime.now().isoformat(),
+        new_documents=0,
+        processed=0,
+        failed=0
+    )
+    
+    try:
+        # One browser and one HTTP/2 connection pool for the whole run
+        async with async_playwright() as p, httpx.AsyncClient(
+            http2=True,
+            timeout=30,
+            follow_redirects=True,
+            headers={"User-Agent": USER_AGENT}
+        ) as http_client:
+            browser = await p.chromium.launch(
+                headless=True,
+                args=["--no-sandbox", "--disable-dev-shm-usage"]
+            )
             
-            for pdf_url in pdf_links:
-                new_docs.append((date, title, doc_type, pdf_url))
-        
-        # Process new documents
-        for date, title, doc_type, pdf_url in new_docs:
             try:
-                success = await process_new_document(date, title, doc_type, pdf_url)
-                if success:
-                    cron_status["processed"] += 1
-                else:
-                    cron_status["failed"] += 1
-                    
-                # Small delay
-                await asyncio.sleep(2)
-                
-            except Exception as e:
-                print(f"[ERROR] {str(e)}")
-                cron_status["failed"] += 1
+                prepared = await scrape_and_prepare(browser, http_client)
+            finally:
+                await browser.close()
         
-        # Update status
-        cron_status["status"] = "completed"
-        cron_status["message"] = f"Processed {cron_status['processed']} new documents, {cron_status['failed']} failed"
+        # Embedding can wait hours on the Batch API, so the browser and
+        # HTTP/2 pool are closed first
+        if prepared is not None:
+            await embed_and_store(*prepared)
         
     except Exception as e:
-        cron_status["status"] = "error"
-        cron_status["message"] = f"Error: {str(e)}"
+        await set_cron_status(status="error", message=f"Error: {str(e)}")
 
 
 # API Endpoints
@@ -439,14 +1179,21 @@ async def trigger_bnm_scrape(background_tasks: BackgroundTasks):
     - Vercel Cron
     - Manual trigger
     """
-    global cron_status
+    lock_token = None
     
-    # Check if already running
-    if cron_status["status"] == "running":
+    # Check if already running; with Redis, atomically across workers
+    if redis_client:
+        try:
+            lock_token = await acquire_run_lock()
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Cron lock unavailable: {str(e)}")
+        if not lock_token:
+            raise HTTPException(status_code=409, detail="Cron job already running")
+    elif cron_status.status == "running":
         raise HTTPException(status_code=409, detail="Cron job already running")
     
     # Start background task
-    background_tasks.add_task(run_daily_scrape)
+    background_tasks.add_task(run_daily_scrape, lock_token)
     
     return CronResponse(
         status="started",
@@ -458,7 +1205,7 @@ async def trigger_bnm_scrape(background_tasks: BackgroundTasks):
 @app.get("/api/cron/status", response_model=StatusResponse)
 async def get_cron_status():
     """Get the status of the last cron job run."""
-    return StatusResponse(**cron_status)
+    return StatusResponse(**asdict(await get_shared_cron_status()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,14 @@
+-- Embeddings keyed by a SHA-256 of model, dimensions and cleaned page text,
+-- so boilerplate shared across BNM circulars is only embedded once.
+create extension if not exists vector;
+
+create table if not exists embedding_cache (
+    content_hash text primary key,
+    embedding vector(1536) not null,
+    created_at timestamptz not null default now()
+);
+
+-- Only the service-role key (which bypasses RLS) may use the cache. With no
+-- policies, the anon key shipped to the frontend can neither read nor plant
+-- vectors under a known content hash.
+alter table embedding_cache enable row level security;
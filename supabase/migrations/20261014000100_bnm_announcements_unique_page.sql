@@ -0,0 +1,14 @@
+-- One row per page of each PDF, so the cron can insert with
+-- ON CONFLICT DO NOTHING. pdf_url is part of the key because a single
+-- announcement (title, date) can link several PDFs.
+delete from bnm_announcements a
+using bnm_announcements b
+where a.ctid > b.ctid
+  and a.title = b.title
+  and a.date = b.date
+  and a.pdf_url = b.pdf_url
+  and a.page_number = b.page_number;
+
+alter table bnm_announcements
+    add constraint bnm_announcements_page_key
+    unique (title, date, pdf_url, page_number);